@@ -2,31 +2,72 @@
 Core definitions for pyfwup.
 """
 
+from collections import deque
+
+
+def _itersubclasses(cls):
+    """
+    Yields each descendent class of the given class exactly once, in breadth-first order.
+    """
+
+    seen  = set()
+    queue = deque(cls.__subclasses__())
+
+    while queue:
+        subclass = queue.popleft()
+
+        # Classes with multiple parents may be reachable more than once; only visit them once.
+        if subclass in seen:
+            continue
+
+        seen.add(subclass)
+        queue.extend(subclass.__subclasses__())
+
+        yield subclass
+
+
 class FwupTarget(object):
     """
     Abstract base class for pyfwup supported boards. Allows use in fwup-util and derivatives.
     """
 
+    # Caches mapping utility/target names to target classes; built lazily on first lookup.
+    # Each is keyed by the class the lookup was performed on, as lookups only search its descendents.
+    _utility_name_cache = {}
+    _target_name_cache  = {}
+
+
+    def __init_subclass__(cls, **kwargs):
+        """ Invalidates our name caches whenever a new target type is defined. """
+
+        super().__init_subclass__(**kwargs)
+
+        FwupTarget._utility_name_cache.clear()
+        FwupTarget._target_name_cache.clear()
+
+
     @classmethod
-    def __search_descendent_classes(cls, condition):
+    def __populate_name_caches(cls):
         """
-        Search all descendent classes for a class that meets the given condition.
+        Builds our name lookup tables for this class with a single walk of its descendents.
         """
 
-        # Search each of our subclasses for a class that matches the given condition.
-        for subclass in cls.__subclasses__():
+        utility_names = {}
+        target_names  = {}
 
-            # If we find a match, return it...
-            if condition(subclass):
-                return subclass
+        for subclass in _itersubclasses(cls):
 
-            # ... and allow each of its subclasses to do the same.
-            match = subclass.__search_descendent_classes(condition)
-            if match:
-                return match
+            # If more than one class claims a name, the first one found wins.
+            utility_name = getattr(subclass, 'FWUP_UTILITY_NAME', None)
+            if utility_name is not None:
+                utility_names.setdefault(utility_name, subclass)
 
-        # If we didn't find anything, return None.
-        return None
+            target_name = getattr(subclass, 'FWUP_TARGET_NAME', None)
+            if target_name is not None:
+                target_names.setdefault(target_name, subclass)
+
+        FwupTarget._utility_name_cache[cls] = utility_names
+        FwupTarget._target_name_cache[cls]  = target_names
 
 
     @classmethod
@@ -34,7 +75,11 @@ class FwupTarget(object):
         """
         Returns the board type appropriate for the given utility name.
         """
-        return cls.__search_descendent_classes(lambda subclass : subclass.FWUP_UTILITY_NAME == utility_name)
+
+        if cls not in FwupTarget._utility_name_cache:
+            cls.__populate_name_caches()
+
+        return FwupTarget._utility_name_cache[cls].get(utility_name)
 
 
     @classmethod
@@ -42,7 +87,11 @@ class FwupTarget(object):
         """
         Returns the board type appropriate for the given utility name.
         """
-        return cls.__search_descendent_classes(lambda subclass : subclass.FWUP_TARGET_NAME == target_name)
+
+        if cls not in FwupTarget._target_name_cache:
+            cls.__populate_name_caches()
+
+        return FwupTarget._target_name_cache[cls].get(target_name)
 
 
     @staticmethod
@@ -2,11 +2,8 @@
 DFU programming functionality.
 """
 
-import re
-import argparse
-import collections
+import itertools
 import struct
-import sys
 import time
 
 import usb.core
@@ -17,6 +14,10 @@ from .core import FwupTarget
 from .errors import BoardNotFoundError
 
 
+# Layout of the response to a DFU_GET_STATUS request.
+_DFU_STATUS = struct.Struct("<BHBBx")
+
+
 class DFUError(IOError):
     """ Error representing a device-reported DFU error. """
 
@@ -55,10 +56,21 @@ class DFUTarget(FwupTarget):
     DFU_STATE_DFU_UPLOAD_IDLE          = 0x09
     DFU_STATE_DFU_ERROR                = 0x0a
 
+    # States in which a download command has finished, successfully or otherwise.
+    DFU_FINISHED_DOWNLOAD_STATES       = frozenset((DFU_STATE_DFU_ERROR, DFU_STATE_DFU_DOWNLOAD_IDLE))
+
     # Misc constants.
     DFU_STATUS_LENGTH                  = 6
+    DFU_REQUEST_TIMEOUT                = 5000
     DFU_WILL_DETACH                    = (1 << 3)
 
+    # How often to look for the device while waiting for it to reenumerate after a DFU_DETACH, in seconds.
+    # We only check for its presence this often; we fully reconnect only once it has appeared.
+    DFU_DETACH_POLL_INTERVAL           = 0.02
+
+    # The approximate number of progress updates to issue while programming.
+    PROGRESS_UPDATE_COUNT              = 100
+
     # USB standard constants.
     DFU_DEVICE_CLASS                   = 0xFE
     DFU_DEVICE_SUBCLASS                = 0x01
@@ -83,8 +95,8 @@ class DFUTarget(FwupTarget):
         """
         Locates any DFU-compatible interfaces on any configuration the device has.
 
-        Returns a 2-tuple with <configuration value>, <interface number> if a DFU interface
-        exists on the device; or None, None if none exists.
+        Returns a 3-tuple with <configuration value>, <interface number>, <interface> if a DFU
+        interface exists on the device; or None, None, None if none exists.
         """
 
         # Check every interface of every configuration.
@@ -96,21 +108,38 @@ class DFUTarget(FwupTarget):
                 matches_subclass = interface.bInterfaceSubClass == cls.DFU_DEVICE_SUBCLASS
 
                 # If this matches both our class and subclass, it's a DFU device.
-                # Return its interface number.
+                # Return its interface number, and the interface itself.
                 if matches_class and matches_subclass:
-                    return configuration.bConfigurationValue, interface.bInterfaceNumber
+                    return configuration.bConfigurationValue, interface.bInterfaceNumber, interface
 
-        return None, None
+        return None, None, None
 
 
     @classmethod
     def __is_dfu_device(cls, device):
         """ Returns true iff the given pyusb device is DFU-capable. """
 
-        _, interface = cls.__find_dfu_interface_on_device(device)
+        _, interface, _ = cls.__find_dfu_interface_on_device(device)
         return (interface is not None)
 
 
+    @classmethod
+    def __is_dfu_mode_device(cls, device):
+        """ Returns true iff the given pyusb device is DFU-capable, and in DFU (rather than runtime) mode. """
+
+        _, _, interface = cls.__find_dfu_interface_on_device(device)
+        return (interface is not None) and (interface.bInterfaceProtocol != 1)
+
+
+    @classmethod
+    def __find_dfu_mode_device(cls, *args, **kwargs):
+        """
+        Returns the first USB device currently in DFU mode, or None if there isn't one.
+        Accepts the same arguments as pyusb's usb.core.find(), allowing for specificity.
+        """
+        return usb.core.find(*args, custom_match=cls.__is_dfu_mode_device, **kwargs)
+
+
     @classmethod
     def find_dfu_devices(cls, *args, **kwargs):
         """
@@ -131,15 +160,19 @@ class DFUTarget(FwupTarget):
 
         """
 
-        # Find a DFU device to work with.
-        devices = list(self.find_dfu_devices(*args, **kwargs))
+        # Find a DFU device to work with. We only examine devices until we reach the one we want,
+        # as checking each device for DFU support requires walking its descriptors.
+        devices = self.find_dfu_devices(*args, **kwargs)
         try:
-            self.device = devices[index]
-        except:
+            if index >= 0:
+                self.device = next(itertools.islice(devices, index, None))
+            else:
+                self.device = list(devices)[index]
+        except (StopIteration, IndexError):
             raise BoardNotFoundError()
 
         # Determine which configuration and interface expose DFU functionality...
-        self.configuration, self.interface = self.__find_dfu_interface_on_device(self.device)
+        self.configuration, self.interface, self._dfu_interface = self.__find_dfu_interface_on_device(self.device)
 
         # Detach any kernel driver that has claimed the device. This raises an
         # exception on Windows. On Linux or macOS it may raise an exception if
@@ -165,6 +198,10 @@ class DFUTarget(FwupTarget):
         # (which is a useful thing to know at this point regardless of the OS).
         usb.util.claim_interface(self.device, self.interface)
 
+        # We issue a control request for every block we download, and at least one more to check its status;
+        # so bind our device's control transfer method once, rather than looking it up for each request.
+        self._ctrl = self.device.ctrl_transfer
+
         # Read the device's download parameters.
         self.__read_device_info()
 
@@ -178,30 +215,33 @@ class DFUTarget(FwupTarget):
                 # Disconnect device, wait for reenumeration and start over.
                 start = time.time()
                 while True:
-                    try:
-                        usb.util.release_interface(self.device, self.interface)
-                        usb.util.dispose_resources(self.device)
-                        self.__init__(index=index, detach=False, *args, **kwargs)
-                    except (BoardNotFoundError, usb.USBError, NotImplementedError):
-                        # Various transient errors are likely on Windows
-                        # shortly after device enumeration of a device that is
-                        # not yet ready.
-                        pass
-                    else:
-                        if not self.runtime_mode:
-                            break
+
+                    # Reconnecting is expensive, and hard on a device that's still enumerating; so only try
+                    # once a matching device in DFU mode has appeared, which is cheap to check for.
+                    if self.__find_dfu_mode_device(*args, **kwargs) is not None:
+                        try:
+                            usb.util.release_interface(self.device, self.interface)
+                            usb.util.dispose_resources(self.device)
+                            self.__init__(index=index, detach=False, *args, **kwargs)
+                        except (BoardNotFoundError, usb.USBError, NotImplementedError):
+                            # Various transient errors are likely on Windows
+                            # shortly after device enumeration of a device that is
+                            # not yet ready.
+                            pass
+                        else:
+                            if not self.runtime_mode:
+                                break
                     if ((time.time() - start) * 1000) >= timeout:
                         raise BoardNotFoundError("Device not found after DFU_DETACH.")
-                    time.sleep(0.1)
+                    time.sleep(self.DFU_DETACH_POLL_INTERVAL)
 
 
     def __read_device_info(self):
         """ Retrieve information from the DFU-capable device. """
-        for configuration in self.device:
-            intf = usb.util.find_descriptor(configuration, bInterfaceClass=self.DFU_DEVICE_CLASS,
-                                            bInterfaceSubClass=self.DFU_DEVICE_SUBCLASS)
-            self.runtime_mode = (intf.bInterfaceProtocol == 1)
-            self.__parse_dfu_functional_descriptor(intf.extra_descriptors)
+
+        # Use the DFU interface we found when connecting, rather than searching the device's descriptors again.
+        self.runtime_mode = (self._dfu_interface.bInterfaceProtocol == 1)
+        self.__parse_dfu_functional_descriptor(self._dfu_interface.extra_descriptors)
 
 
     def __parse_dfu_functional_descriptor(self, dfu_desc):
@@ -214,28 +254,21 @@ class DFUTarget(FwupTarget):
         self.transfer_size  = dfu_desc[6] << 8 | dfu_desc[5]
 
 
-    def __dfu_out_request(self, request, value, data, timeout=5000):
+    def __dfu_out_request(self, request, value, data, timeout=DFU_REQUEST_TIMEOUT):
         """ Convenience function that issues a DFU OUT control request to our device. """
 
-        self.device.ctrl_transfer(self.USB_CLASS_OUT_REQUEST_TO_INTERFACE, request, value,
-            self.interface, data, timeout)
-
-
-    def __dfu_in_request(self, request, value, length, timeout=5000):
-        """ Convenience function that issues a DFU IN control request, reading data from our device. """
-
-        return self.device.ctrl_transfer(self.USB_CLASS_IN_REQUEST_TO_INTERFACE, request, value,
-            self.interface, length, timeout)
+        self._ctrl(self.USB_CLASS_OUT_REQUEST_TO_INTERFACE, request, value, self.interface, data, timeout)
 
 
     def __get_status(self):
         """ Retrieve the device's current DFU status. """
 
         # Grab and the DFU status...
-        raw_status = self.__dfu_in_request(self.DFU_GET_STATUS, 0, self.DFU_STATUS_LENGTH)
+        raw_status = self._ctrl(self.USB_CLASS_IN_REQUEST_TO_INTERFACE, self.DFU_GET_STATUS, 0,
+            self.interface, self.DFU_STATUS_LENGTH, self.DFU_REQUEST_TIMEOUT)
 
         # ... and extract is component parts.
-        status, poll_timeout_low, poll_timeout_high, state = struct.unpack("<BHBBx", raw_status)
+        status, poll_timeout_low, poll_timeout_high, state = _DFU_STATUS.unpack(raw_status)
         poll_timeout = (poll_timeout_high << 16) | poll_timeout_low
 
         return status, poll_timeout, state
@@ -244,16 +277,22 @@ class DFUTarget(FwupTarget):
     def __complete_command(self):
         """ Blocks until the given command completes, checking status. """
 
+        # This loop runs at least once for every block we download; so look up what it uses only once.
+        get_status      = self.__get_status
+        finished_states = self.DFU_FINISHED_DOWNLOAD_STATES
+        sleep           = time.sleep
+
         while True:
-            status, poll_timeout, state = self.__get_status()
+            status, poll_timeout, state = get_status()
 
             # If the the DFU device is in a finished state, break out.
-            if state in (self.DFU_STATE_DFU_ERROR, self.DFU_STATE_DFU_DOWNLOAD_IDLE):
+            if state in finished_states:
                 break
 
-            # Otherwise, wait for the provided poll timeout.
+            # Otherwise, wait for the provided poll timeout before asking again. Devices that are
+            # ready to be polled again immediately report a zero timeout; we don't sleep at all for those.
             if poll_timeout:
-                time.sleep(poll_timeout / 1000)
+                sleep(poll_timeout / 1000)
 
 
         # Check to make sure the command completed correctly.
@@ -274,7 +313,8 @@ class DFUTarget(FwupTarget):
 
         # Download the firmware to the device...
         self.last_block_number = block_number
-        self.__dfu_out_request(self.DFU_DOWNLOAD, block_number, data)
+        self._ctrl(self.USB_CLASS_OUT_REQUEST_TO_INTERFACE, self.DFU_DOWNLOAD, block_number,
+            self.interface, data, self.DFU_REQUEST_TIMEOUT)
 
         # ... and wait for the command to complete.
         self.__complete_command()
@@ -298,25 +338,38 @@ class DFUTarget(FwupTarget):
     def program(self, program_data, status_callback=None):
         """ Uploads a given program to the target DFU device. """
 
-        for page_address in range(0, len(program_data), self.transfer_size):
+        # Pages are sliced from the program as-is: pyusb copies bytes-like data with a single memcpy,
+        # but has to convert other buffers (e.g. memoryviews) element-by-element.
+        program_size  = len(program_data)
+        transfer_size = self.transfer_size
+        report_status = callable(status_callback)
+
+        # Only report our progress every few pages; status callbacks typically redraw a progress bar,
+        # which can take longer than downloading a page on a fast device.
+        update_stride = max(1, program_size // self.PROGRESS_UPDATE_COUNT // transfer_size) * transfer_size
+
+        # Note that blocks are deliberately sent one at a time: the DFU state machine requires each
+        # DFU_DOWNLOAD to be acknowledged via GET_STATUS (reaching dfuDNLOAD-IDLE) before the next block
+        # is accepted, so downloads can't be pipelined. We only sleep when the device asks us to.
+        for page_address in range(0, program_size, transfer_size):
 
             # Extract the page to be programmed...
-            data_to_program = program_data[page_address : page_address + self.transfer_size]
+            data_to_program = program_data[page_address : page_address + transfer_size]
 
             # ... and download it to the device.
             self.__raw_write_page(page_address, data_to_program)
 
             # Issue our status callback to indicate our progress.
-            if callable(status_callback):
-                status_callback(page_address, len(program_data))
+            if report_status and (page_address % update_stride == 0):
+                status_callback(page_address, program_size)
 
 
         # Notify the device that we're done programming.
         self.__send_download_complete()
 
         # Report that we're 100% programmed.
-        if callable(status_callback):
-            status_callback(len(program_data), len(program_data))
+        if report_status:
+            status_callback(program_size, program_size)
 
 
     def run_user_program(self):
@@ -8,5 +8,9 @@ class BoardNotFoundError(IOError):
 	""" Class representing a condition where no board was found. """
 
 
+class IncompatibleDeviceError(BoardNotFoundError):
+	""" Class representing a condition where a board was found, but isn't one we can program. """
+
+
 class ProgrammingFailureError(IOError):
 	""" Class representing a condition where programming failed. """
@@ -7,8 +7,6 @@ import struct
 import usb
 import usb.core
 
-from collections import OrderedDict
-
 from .core import FwupTarget
 from .errors import BoardNotFoundError, ProgrammingFailureError
 
@@ -37,11 +35,11 @@ class FX3Target(FwupTarget):
     def __init__(self, wait=True, fast_mode=False, *args, **kwargs):
         """ Creates a new connection to a given micronucleus bootloader. """
 
-        vid = kwargs.get('idVendor', default=TARGET_VID)
-        pid = kwargs.get('idProduct', default=TARGET_PID)
+        vid = kwargs.get('idVendor', TARGET_VID)
+        pid = kwargs.get('idProduct', TARGET_PID)
 
         # Try to find an FX3 device in bootloader mode.
-        self.device = usb.core.find(idVendor=vid, idProduct=pid)
+        self.device = usb.core.find(idVendor=vid, idProduct=pid, backend=kwargs.get('backend'))
         if self.device is None:
             raise BoardNotFoundError()
 
@@ -71,17 +69,9 @@ class FX3Target(FwupTarget):
     def _upload_firmware(self, address, data):
         """ Uploads a chunk of firmware to the device. """
 
-        to_upload = data[:]
-
-        while to_upload:
-
-            # Break the firmware to upload into maximum-size chunks..
-            chunk = to_upload[0:USB_REQUEST_MAX_SIZE]
-            del to_upload[0:USB_REQUEST_MAX_SIZE]
-
-            # ... and upload them chunk-by-chunk.
-            self._upload_firmware_chunk(address, chunk)
-            address += len(chunk)
+        # Break the firmware to upload into maximum-size chunks, and upload them chunk-by-chunk.
+        for offset in range(0, len(data), USB_REQUEST_MAX_SIZE):
+            self._upload_firmware_chunk(address + offset, data[offset:offset + USB_REQUEST_MAX_SIZE])
 
 
     def _print_target_info(self, print_function):
@@ -100,34 +90,36 @@ class FX3Target(FwupTarget):
     @staticmethod
     def _parse_program_data(program_data):
 
-        program_chunks = OrderedDict()
-        remaining_data = bytearray(program_data)
+        program_chunks = {}
+        data = memoryview(program_data)
 
         # Read our program header.
-        if program_data[0:2] != b"CY":
+        if data[0:2] != b"CY":
             raise ValueError("The provided file does not appear to be a Cypress image file.")
-        del remaining_data[0:4]
+        position = 4
 
         # Parse our cypress image data for as long as data potentially remains.
-        while len(remaining_data) >= 8:
+        while len(data) - position >= 8:
 
-            # Extract the first eight bytes of the stream, which should contain two words:
+            # Extract the next eight bytes of the stream, which should contain two words:
             # the address of the following data chunk, and its length.
-            header = remaining_data[0:8]
-            size, address = struct.unpack("<II", header)
-            del remaining_data[0:8]
+            size, address = struct.unpack_from("<II", data, position)
+            position += 8
 
             # Convert our size from a size-in-bytes to a size-in-words.
             size *= 4
 
             # A chunk of raw data of the size specified follows the little header.
-            if len(remaining_data) < size:
+            # Validate its length before we use it, so a corrupt header can't send us past the end of the image.
+            remaining = len(data) - position
+            if remaining < size:
                 raise EOFError("a chunk header specified {} should be read; but only {} were remaining".format(
-                        size, len(remaining_data)))
+                        size, remaining))
 
-            # Grab the chunk, and move on to the next set of data.
-            program_chunks[address] = remaining_data[0:size]
-            del remaining_data[0:size]
+            # Grab a copy of the chunk, and move on to the next set of data. We store plain bytes rather than
+            # a view, as pyusb can copy bytes into a transfer in one go, but converts views byte-by-byte.
+            program_chunks[address] = bytes(data[position:position + size])
+            position += size
 
         return program_chunks
 
@@ -139,18 +131,14 @@ class FX3Target(FwupTarget):
 
     def size_to_program(self, program_data):
         """ Computes the total size of the data to be programmed. """
-        size = 0
 
-        if isinstance(program_data, OrderedDict):
+        if isinstance(program_data, dict):
             chunks_to_program  = program_data
         else:
             chunks_to_program  = self._parse_program_data(program_data)
 
         # Summarize each of the chunks to be programmed.
-        for _, data in chunks_to_program.items():
-            size += len(data)
-
-        return size
+        return sum(map(len, chunks_to_program.values()))
 
 
     def program(self, program_data, status_callback=None):
@@ -7,6 +7,11 @@ import struct
 from .dfu import DFUTarget
 
 
+# Layout of the LPC DFU image header: a fixed magic, the image size in blocks, and 0xFF padding.
+_LPC_HEADER     = struct.Struct("<BBH")
+_LPC_HEADER_PAD = b"\xff" * 12
+
+
 class LPC43xxTarget(DFUTarget):
     """
     Class representing an LPC43xx in DFU mode.
@@ -42,22 +47,23 @@ class LPC43xxTarget(DFUTarget):
     def program(self, program_data, status_callback=None):
         """ Uploads a program to the LPC43xx's RAM. """
 
-        # Ensure that our program data is in a mutable byte format.
-        program_data = bytearray(program_data)
-
         #
-        # Append an LPC DFU header.
+        # Prepend an LPC DFU header.
         #
 
         # Determine the number of total blocks, including this header.
         # This math rounds up to the next full block.
-        program_size_blocks = (len(program_data) + (self.BLOCK_SIZE - self.HEADER_SIZE - 1)) // 512
+        program_size_blocks = (len(program_data) + (self.BLOCK_SIZE - self.HEADER_SIZE - 1)) // self.BLOCK_SIZE
 
-        header = struct.pack("<BBH", 0xda, 0xff, program_size_blocks) + (b"\xff" *12)
-        program_data[0:0] = header
+        # Build the final image in a single allocation, writing the header directly into place rather
+        # than inserting it in front of the program, which would require moving the whole program.
+        image = bytearray(self.HEADER_SIZE + len(program_data))
+        _LPC_HEADER.pack_into(image, 0, 0xda, 0xff, program_size_blocks)
+        image[_LPC_HEADER.size:self.HEADER_SIZE] = _LPC_HEADER_PAD
+        image[self.HEADER_SIZE:] = program_data
 
         # And call the main DFU functionality.
-        super(LPC43xxTarget, self).program(program_data, status_callback)
+        super(LPC43xxTarget, self).program(image, status_callback)
 
 
 
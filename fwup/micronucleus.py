@@ -5,12 +5,20 @@ import usb
 import usb.core
 
 from .core import FwupTarget
-from .errors import BoardNotFoundError, ProgrammingFailureError
+from .errors import BoardNotFoundError, IncompatibleDeviceError, ProgrammingFailureError
 
 MICRONUCLEUS_VID     = 0x16d0
 MICRONUCLEUS_PID     = 0x0753
 MICRONUCLEUS_TIMEOUT = 1000
 
+# How long to wait between searches for a micronucleus device, in seconds.
+MICRONUCLEUS_POLL_INTERVAL = 0.1
+
+# While erasing: how long to wait between checks for a responsive device, in seconds;
+# and the timeout for each check, in milliseconds.
+MICRONUCLEUS_ERASE_POLL_INTERVAL = 0.01
+MICRONUCLEUS_ERASE_POLL_TIMEOUT  = 50
+
 
 class MicronucleusBoard(FwupTarget):
     """ Class that allows one to program a Micronucleus bootloader target. """
@@ -43,6 +51,10 @@ class MicronucleusBoard(FwupTarget):
     # Request that the bootloader jump to the user application.
     REQUEST_START_APPLICATION = 4
 
+    # The request types for our vendor requests, in each direction.
+    _BMREQ_IN  = usb.ENDPOINT_IN  | usb.TYPE_VENDOR | usb.RECIP_DEVICE
+    _BMREQ_OUT = usb.ENDPOINT_OUT | usb.TYPE_VENDOR | usb.RECIP_DEVICE
+
 
     #
     # AVR program data.
@@ -53,6 +65,11 @@ class MicronucleusBoard(FwupTarget):
     AVR_RJMP_OPCODE      = 0xc000
     AVR_RJMP_REACH_BYTES = 0x2000
 
+    # Layouts of our jump instructions: an RJMP is a single little-endian word;
+    # a long jump is its opcode word followed by its target.
+    _AVR_RJMP      = struct.Struct("<H")
+    _AVR_LONG_JUMP = struct.Struct("<HH")
+
     #
     # Mapping that translates signatures to AVR names.
     #
@@ -73,10 +90,14 @@ class MicronucleusBoard(FwupTarget):
     def __init__(self, wait=True, fast_mode=False, *args, **kwargs):
         """ Creates a new connection to a given micronucleus bootloader. """
 
-        self.target_vid = kwargs.get('idVendor', default=MICRONUCLEUS_VID)
-        self.target_pid = kwargs.get('idProduct', default=MICRONUCLEUS_PID)
+        self.target_vid = kwargs.get('idVendor', MICRONUCLEUS_VID)
+        self.target_pid = kwargs.get('idProduct', MICRONUCLEUS_PID)
+        self.backend    = kwargs.get('backend')
         self.fast_mode = fast_mode
 
+        # The time (per time.monotonic) at which the device will have finished writing the last page we sent.
+        self._write_deadline = 0
+
         # Attempt to grab a connection to the device.
         self._try_connect(wait=wait)
 
@@ -84,33 +105,58 @@ class MicronucleusBoard(FwupTarget):
         self._populate_info_from_device()
 
 
-    def _try_connect(self, wait=True, post_connect_delay=0.5):
-        """ Attempts to connect to a given micronucleus device. Useful for both connecting and reconnecting."""
+    def _try_connect(self, wait=True, post_connect_delay=0.5, always_delay=False):
+        """ Attempts to connect to a given micronucleus device. Useful for both connecting and reconnecting.
+
+        Params:
+            wait               -- If true, keeps searching until a device appears; otherwise, searches only once.
+            post_connect_delay -- The time to wait after finding a device that was just plugged in, in seconds.
+            always_delay       -- If true, waits out the post-connect delay even if the device was already present.
+        """
 
         self.device = None
+        found_immediately = True
 
         # Loop until we've found a micronucleus device.
-        while (not self.device) and wait:
+        while not self.device:
 
             # Try to find a micronucleus bootloader.
-            candidate = usb.core.find(idVendor=self.target_vid, idProduct=self.target_pid)
+            candidate = usb.core.find(idVendor=self.target_vid, idProduct=self.target_pid, backend=self.backend)
+
+            # If we've found a device, use it -- provided it speaks a protocol we understand.
+            # If it doesn't, there's no point in waiting for it to change its mind.
+            if candidate is not None:
+                if not self._validate_device_compatibility(candidate):
+                    protocol = candidate.bcdDevice >> 8
+                    raise IncompatibleDeviceError(
+                        "Found a micronucleus device with an unsupported protocol (v{}).".format(protocol))
 
-            #	If this device
-            if self._validate_device_compatibility(candidate):
                 self.device = candidate
 
+                # Bind our control transfer method once, as we'll issue several requests per page programmed.
+                self._ctrl = self.device.ctrl_transfer
+
+            # If we couldn't find a board, and we're not waiting for one, error out.
+            elif not wait:
+                raise BoardNotFoundError()
+
+            # Otherwise, give the device a little while to appear before we search again.
+            else:
+                found_immediately = False
+                time.sleep(MICRONUCLEUS_POLL_INTERVAL)
+
         # For systems like Linux, we'll need a small post-connect delay to allow udev to catch up
         # if the device was just plugged in. Otherwise, the device may still have its initial perms.
-        time.sleep(post_connect_delay)
-
-        # If we couldn't find a board (i.e. if wait wasn't set), error out.
-        if self.device is None:
-            raise BoardNotFoundError()
+        # If the device was already present when we started looking, udev has long since caught up.
+        if always_delay or not found_immediately:
+            time.sleep(post_connect_delay)
 
 
     def reconnect(self, wait=True):
         """ Attempts to reconnect to the given board. """
-        self._try_connect(wait=wait)
+
+        # Our board has likely just re-enumerated; so always give udev a chance to catch up.
+        self._try_connect(wait=wait, always_delay=True)
 
 
     @classmethod
@@ -126,22 +172,12 @@ class MicronucleusBoard(FwupTarget):
 
     def _request_in(self, number, length, index=0, value=0, timeout=MICRONUCLEUS_TIMEOUT):
         """ Requests data from the Micronucleus device. """
-
-        # Prepare the metadata that identifies how we're communicating...
-        type_data = usb.ENDPOINT_IN | usb.TYPE_VENDOR | usb.RECIP_DEVICE
-
-        # ... and use it to perform our core control request.
-        return self.device.ctrl_transfer(type_data, number, index, value, length, timeout=timeout)
+        return self._ctrl(self._BMREQ_IN, number, index, value, length, timeout)
 
 
     def _request_out(self, number, data=None, value=0, index=0, timeout=MICRONUCLEUS_TIMEOUT):
         """ Issues data to the Micronucleus device, or issues a command without data. """
-
-        # Prepare the metadata that identifies how we're communicating...
-        type_data = usb.ENDPOINT_OUT | usb.TYPE_VENDOR | usb.RECIP_DEVICE
-
-        # ... and use it to perform our core control request.
-        return self.device.ctrl_transfer(type_data, number, value, index, data, timeout=timeout)
+        return self._ctrl(self._BMREQ_OUT, number, value, index, data, timeout)
 
 
     def _populate_info_from_device(self):
@@ -162,12 +198,8 @@ class MicronucleusBoard(FwupTarget):
             raise ValueError("Trying to handle a device with an unknown protocol!")
 
 
-        # Compute the page count, for later convenience.
-        self.page_count = int(self.flash_size / self.page_size)
-
-        # Account for possible integer-division errors in page-count computation.
-        if (self.page_count * self.page_size < self.flash_size):
-            self.page_count += 1
+        # Compute the page count, for later convenience. This rounds up to include any partial page.
+        self.page_count = -(-self.flash_size // self.page_size)
 
         # Parse our encoded write duration: essentially, we strip out the MSB, which is a flag.
         self.write_duration_ms = encoded_write_duration & 0x7f
@@ -181,14 +213,22 @@ class MicronucleusBoard(FwupTarget):
         self.erase_duration_ms = self.write_duration_ms * self.page_count
 
         # If that flag is set, our erase duration is a quarter of the time it'd take to write to every page.
+        # We round up, so we never wait less than the erase requires.
         if (encoded_write_duration & 0x80):
-            self.erase_duration_ms /= 4
+            self.erase_duration_ms = -(-self.erase_duration_ms // 4)
 
         # Finally, figure out where our bootloader starts.
         # Note that this is roughly equivalent to self.flash_size, as the bootloader starts just after the
         # user program, but it
         self.bootloader_start = self.page_count * self.page_size
 
+        # Create a blank (erased) page, and a buffer we'll use to pad out any partial pages we program.
+        self._blank_page  = b'\xFF' * self.page_size
+        self._page_buffer = bytearray(self._blank_page)
+
+        # Create a parser that splits a page into its component words; used to program v2 devices.
+        self._page_words = struct.Struct("<{}H".format(self.page_size // 2))
+
 
     def _print_target_info(self, print_function):
         """ Prints information about the relevant board, if possible."""
@@ -213,11 +253,15 @@ class MicronucleusBoard(FwupTarget):
         except usb.core.USBError:
             requires_reconnect = True
 
-        # ... and wait for that to complete.
-        time.sleep(self.erase_duration_ms / 1000.0)
+        # ... and wait for that to complete. If the board is still talking to us, we can check
+        # whether it's finished; otherwise, we'll have to wait out the full erase time.
+        if requires_reconnect:
+            time.sleep(self.erase_duration_ms / 1000.0)
+        elif not self._wait_for_erase_completion():
+            requires_reconnect = True
 
-        # If we error'd out, this is likely because the board got caught up erasing
-        # and failed to handle its USB communication duties. Reconnect.
+        # If we error'd out, or the board stopped responding, this is likely because the board got caught
+        # up erasing and failed to handle its USB communication duties. Reconnect.
         if requires_reconnect:
             try:
                 self.reconnect()
@@ -225,6 +269,45 @@ class MicronucleusBoard(FwupTarget):
                 raise ProgrammingFailureError()
 
 
+    def _wait_for_erase_completion(self):
+        """ Waits for the board to finish erasing its flash.
+
+        The board can't service USB requests while it's erasing; so rather than always waiting for the
+        worst-case erase time, we poll it. Once we've seen the board go busy, we return as soon as it
+        responds again. If it never appears busy, we can't tell whether it's started erasing yet, so we
+        wait out the full erase time.
+
+        We never wait longer than the nominal erase time. Returns true iff the board responded within it.
+        """
+
+        erase_end   = time.monotonic() + (self.erase_duration_ms / 1000.0)
+        info_length = 6 if (self.protocol == 2) else 4
+        seen_busy   = False
+
+        # Erasing takes at least as long as a single page write; don't bother asking before then.
+        time.sleep(self.write_duration_ms / 1000.0)
+
+        while time.monotonic() < erase_end:
+            try:
+                self._request_in(self.REQUEST_GET_INFO, info_length, timeout=MICRONUCLEUS_ERASE_POLL_TIMEOUT)
+            except usb.core.USBError:
+                seen_busy = True
+                time.sleep(MICRONUCLEUS_ERASE_POLL_INTERVAL)
+                continue
+
+            # The board is responding. If we've seen it busy, it's finished erasing. Otherwise, it may
+            # not have started yet; so fall back to waiting for the full erase time.
+            if not seen_busy:
+                remaining = erase_end - time.monotonic()
+                if remaining > 0:
+                    time.sleep(remaining)
+
+            return True
+
+        # The board didn't come back within the time its erase should take; it's likely dropped off the bus.
+        return False
+
+
     def size_to_program(self, program_data):
         # We always program the entire flash, no matter the program size.
         return self.flash_size
@@ -239,48 +322,67 @@ class MicronucleusBoard(FwupTarget):
         # Erase the device's flash.
         self.erase()
 
+        # Take pages from a view of the program, so we only copy the pages we need to modify.
+        program_data = memoryview(program_data)
+
+        # Prepare the pages that need special handling up front.
+        patched_pages = {}
+
+        # On the first page, replace the reset vector with a jump to the bootloader...
+        first_page = bytearray(program_data[0 : self.page_size])
+        self._patch_first_page(first_page)
+        patched_pages[0] = first_page
+
+        # ... and into the last page, inject our user reset vector to be used by the bootloader. We always need to
+        # program this page, even if it's past the end of our program; in which case it's padded out with filler.
+        last_page_address = self.bootloader_start - self.page_size
+        if last_page_address in patched_pages:
+            last_page = patched_pages[last_page_address]
+        else:
+            last_page = bytearray(program_data[last_page_address : last_page_address + self.page_size])
+        self._patch_last_page(last_page, reset_address)
+        patched_pages[last_page_address] = last_page
+
+        # Keep a view of a blank page around, so we can cheaply compare pages against it.
+        blank_page = memoryview(self._blank_page)
+
         # For each page in the given program...
         for page_address in range(0, self.flash_size, self.page_size):
 
-            # Determine if this is the first/last page, to enable special page handling.
-            is_first_page = (page_address == 0)
-            is_last_page  = (page_address >= (self.bootloader_start - self.page_size))
+            # Pages we've patched always need to be written.
+            data_to_program = patched_pages.get(page_address)
 
-            # Grab a copy of the page of data to program.
-            try:
-                data_to_program = bytearray(program_data[page_address : page_address + self.page_size])
-            except IndexError:
-                # If this is the last page, and we didn't have data, inject a page-size worth of filler bytes,
-                # as we always need to program the last page in flash.
-                if is_last_page:
-                    data_to_program = bytearray()
-
-                # Otherwise, continue. We can't abort early, as we'll still need to program the last page.
-                else:
-                    continue
-
-            # If this is the first page, replace the reset vector with a jump to the bootloader.
-            if is_first_page:
-                self._patch_first_page(data_to_program)
-
-            # If this is the last page, inject our user reset vector to be used by the bootloader.
-            if is_last_page:
-                self._patch_last_page(data_to_program, reset_address)
-
-            # Finally, write the page to the device.
-            if data_to_program:
+            # Otherwise, grab the page of data to program. We've just erased the flash, so any page that's entirely
+            # blank (0xFF) already holds the right data, and we can skip it. This includes pages past the end of
+            # our program, which will be empty.
+            if data_to_program is None:
+                data_to_program = program_data[page_address : page_address + self.page_size]
+
+                if data_to_program == blank_page[:len(data_to_program)]:
+                    data_to_program = None
+
+            # Finally, write the page to the device. We can't stop early once we run out of program,
+            # as we'll still need to program the last page.
+            if data_to_program is not None:
                 self.__raw_write_page(page_address, data_to_program)
 
             # Issue our status callback to indicate our progress.
             if callable(status_callback):
                 status_callback(page_address, self.flash_size)
 
+        # Finally, ensure our last page is fully written before we return...
+        self._wait_for_write_completion()
+
+        # ... and report that we're 100% programmed.
+        if callable(status_callback):
+            status_callback(self.flash_size, self.flash_size)
+
 
     def _extract_reset_address(self, program_data):
         """ Attempt to extract the reset address of the relevant program from the program data's first page. """
 
         # Split the start of the buffer into a pair of words, which should contain our relevant data.
-        first_word, second_word = struct.unpack("<HH", program_data[0:4])
+        first_word, second_word = self._AVR_LONG_JUMP.unpack_from(program_data)
 
         # If the first word is a long jump, return its immediate argument directly.
         if first_word == self.AVR_LONG_JUMP_OPCODE:
@@ -340,15 +442,35 @@ class MicronucleusBoard(FwupTarget):
             instruction  = self.AVR_RJMP_OPCODE | offset_words
 
             # ... and patch it into the relevant program.
-            page_data[offset_into_page + 0] = instruction & 0xFF
-            page_data[offset_into_page + 1] = instruction >> 8
+            self._AVR_RJMP.pack_into(page_data, offset_into_page, instruction)
 
         # Otherwise, use a long jump instruction.
         else:
-           page_data[offset_into_page + 0] = self.AVR_LONG_JUMP_OPCODE & 0xff
-           page_data[offset_into_page + 1] = self.AVR_LONG_JUMP_OPCODE >> 8
-           page_data[offset_into_page + 2] = jump_target               & 0xff
-           page_data[offset_into_page + 3] = jump_target               >> 8
+            self._AVR_LONG_JUMP.pack_into(page_data, offset_into_page, self.AVR_LONG_JUMP_OPCODE, jump_target)
+
+
+    def _pad_page(self, data):
+        """ Returns the given page data, padded out with 0xFF to be a full page, if necessary.
+
+        Partial pages are padded into a buffer that's reused for each page; so the result is only valid until the
+        next call.
+        """
+
+        length = len(data)
+        if length >= self.page_size:
+            return data
+
+        self._page_buffer[:length] = data
+        self._page_buffer[length:] = memoryview(self._blank_page)[length:]
+        return self._page_buffer
+
+
+    def _wait_for_write_completion(self):
+        """ Blocks until the device has had time to complete the last page write we issued. """
+
+        remaining = self._write_deadline - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
 
 
     def __raw_write_page(self, address, data):
@@ -357,6 +479,9 @@ class MicronucleusBoard(FwupTarget):
             runs correctly each time.
         """
 
+        # Ensure the device has had time to finish writing the previous page before we send another.
+        self._wait_for_write_completion()
+
         #
         if self.protocol == 1:
             self.__raw_write_page_v1(address, data)
@@ -369,30 +494,30 @@ class MicronucleusBoard(FwupTarget):
     def __raw_write_page_v2(self, address, data):
         """ Variant of raw_write_page for the micronucleus v2 protocol. """
 
-        import sys
-
         # Extend out the data to always be page_size.
-        if (len(data) < self.page_size):
-            padding_size = self.page_size - len(data)
-            data += b'\xFF' * padding_size
+        data = self._pad_page(data)
 
         # Send the address of the page we want to write...
         self._request_out(self.REQUEST_WRITE_PAGE, value=self.page_size, index=address)
 
-        # ... and then send its contents.
-        for offset in range(0, self.page_size, 4):
+        # The v2 bootloader only accepts a single DWORD per request, so a page takes many back-to-back requests.
+        # Issue them directly, so we spend as little time as possible between requests.
+        ctrl_transfer = self._ctrl
+        type_data     = self._BMREQ_OUT
 
-            # Grab the DWORD we're programming.
-            chunk = data[offset : offset + 4]
+        # Split the whole page into little-endian words at once; each DWORD we program is a pair of these words.
+        words = self._page_words.unpack(data)
+
+        # ... and then send its contents.
+        for value_chunk, index_chunk in zip(words[0::2], words[1::2]):
 
             # Spread the data across index and value.
             # This is kind of icky, but it allows for a smaller bootloader.
-            value_chunk = (chunk[1] << 8) | chunk[0]
-            index_chunk = (chunk[3] << 8) | chunk[2]
-            self._request_out(self.REQUEST_WRITE_DWORD, value=value_chunk, index=index_chunk)
+            ctrl_transfer(type_data, self.REQUEST_WRITE_DWORD, value_chunk, index_chunk, None, MICRONUCLEUS_TIMEOUT)
 
-        # Once we've sent a full page worth of data, wait for everything to complete.
-        time.sleep(self.write_duration_ms / 1000.0)
+        # Once we've sent a full page worth of data, note when it will have been written.
+        # We'll wait for it only once we need to talk to the device again, leaving us free to prepare the next page.
+        self._write_deadline = time.monotonic() + (self.write_duration_ms / 1000.0)
 
 
     def __raw_write_page_v1(self, address, data):
@@ -401,18 +526,19 @@ class MicronucleusBoard(FwupTarget):
             runs correctly each time.
         """
 
-        import sys
-
         # Extend out the data to always be page_size.
-        if (len(data) < self.page_size):
-            padding_size = self.page_size - len(data)
-            data += b'\xFF' * padding_size
+        data = self._pad_page(data)
+
+        # Pages taken directly from the program are memoryviews; pyusb converts those element-by-element,
+        # but copies bytes in one go. Hand it bytes.
+        if isinstance(data, memoryview):
+            data = data.tobytes()
 
         # Issue the write request...
         self._request_out(self.REQUEST_WRITE_PAGE, value=self.page_size, index=address, data=data)
 
-        # ... and wait for it to complete.
-        time.sleep(self.write_duration_ms / 1000.0)
+        # ... and note when it will have completed.
+        self._write_deadline = time.monotonic() + (self.write_duration_ms / 1000.0)
 
 
     def get_cpu_name(self):
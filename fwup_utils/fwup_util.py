@@ -6,13 +6,19 @@
 import os
 import sys
 import argparse
+import functools
 import platform
 import usb, usb.backend.libusb1
 
 from tqdm import tqdm
 
+if sys.version_info >= (3, 9):
+    from importlib.resources import files
+else:
+    from importlib_resources import files
+
 from fwup.core import FwupTarget
-from fwup.errors import BoardNotFoundError
+from fwup.errors import BoardNotFoundError, IncompatibleDeviceError
 
 # TODO: automatically detect these?
 from fwup.dfu import DFUTarget
@@ -28,6 +34,21 @@ def log_null(string):
     """ Helper that discards input. """
     pass
 
+@functools.lru_cache(maxsize=1)
+def get_backend():
+    """ Returns the libusb1 backend to use to communicate with targets; created only once. """
+
+    # On Windows we need to specify the libusb library location to create a backend.
+    if platform.system() == "Windows":
+        # Determine the path to libusb-1.0.dll.
+        libusb_dll = os.path.join(files("usb1"), "libusb-1.0.dll")
+
+        # Create a backend by explicitly passing the path to libusb_dll.
+        return usb.backend.libusb1.get_backend(find_library=lambda x: libusb_dll)
+    else:
+        # On other systems we can just use the default backend.
+        return usb.backend.libusb1.get_backend()
+
 def main():
     """ Simple programmer for pyfwup supported boards. """
 
@@ -100,24 +121,15 @@ def main():
             log_stderr("Cannot parse the device argument. Please supply a valid vid:pid pair.")
             sys.exit(-4)
 
-    # On Windows we need to specify the libusb library location to create a backend.
-    if platform.system() == "Windows":
-        # Determine the path to libusb-1.0.dll.
-        try:
-            from importlib_resources import files # <= 3.8
-        except:
-            from importlib.resources import files # >= 3.9
-        libusb_dll = os.path.join(files("usb1"), "libusb-1.0.dll")
-
-        # Create a backend by explicitly passing the path to libusb_dll.
-        backend = usb.backend.libusb1.get_backend(find_library=lambda x: libusb_dll)
-    else:
-        # On other systems we can just use the default backend.
-        backend = usb.backend.libusb1.get_backend()
+    # Ensure our target uses the right libusb backend.
+    device['backend'] = get_backend()
 
     # Figure out which to create based on the binary name.
     try:
         board = target_type(**device)
+    except IncompatibleDeviceError as e:
+        log_stderr(str(e))
+        sys.exit(-3)
     except BoardNotFoundError:
         log_stderr("Could not find a {} board!".format(target_name))
         sys.exit(-3)
@@ -135,8 +147,10 @@ def main():
         size_to_program = board.size_to_program(program_data)
 
         log_status("Programming {} bytes...".format(len(program_data)))
+        # Our targets report their progress as a position within the data being programmed (e.g. the address of
+        # the page just written), but tqdm expects to be told how far we've advanced; so convert between the two.
         with tqdm(total=size_to_program, ncols=80, unit='B', leave=False, disable=args.quiet) as progress:
-            board.program(program_data, status_callback = lambda written, _ : progress.update(written))
+            board.program(program_data, status_callback = lambda written, _ : progress.update(written - progress.n))
         log_status("Programming complete!")
 
     # If we're in erase-only mode, erase.